@@ -1,15 +1,12 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-from scipy import stats
-import seaborn as sns
-import matplotlib.pyplot as plt
-import os
-from matplotlib import font_manager as fm
-import matplotlib as mpl
+import io
+import hashlib
+import warnings
 import plotly.express as px
-import scikit_posthocs as sp
-from statsmodels.stats.multicomp import pairwise_tukeyhsd
+import plotly.graph_objects as go
+# scipy.stats と scikit_posthocs は起動を速くするため、検定を実行する関数の中で読み込む
 
 # --- ページ設定 ---
 st.set_page_config(
@@ -18,244 +15,484 @@ st.set_page_config(
     layout="wide",  # ワイドレイアウトで見やすく
 )
 
+# --- サンプルデータ ---
+SAMPLE_CSV_BYTES = (
+    "氏名,所属,性別,研修満足度,講師満足度,業務知識テスト（事前）,業務知識テスト（事後）\n"
+    "山田太郎,営業部,男性,3,4,60,75\n"
+    "佐藤花子,開発部,女性,5,5,55,85\n"
+    "鈴木一郎,人事部,男性,4,5,58,72\n"
+    "田中次郎,開発部,男性,5,4,70,88\n"
+    "高橋三郎,営業部,男性,2,3,65,78\n"
+    "伊藤さくら,人事部,女性,4,5,62,80\n"
+    "渡辺健太,開発部,男性,4,4,80,92\n"
+    "中村恵美,営業部,女性,3,4,59,75\n"
+    "小林直樹,人事部,男性,5,5,68,85\n"
+).encode("utf-8-sig")
+
+# --- 使い方ガイド ---
+# (本文, イメージ画像のURL, 画像の説明) の順。本文はセクションごとに1回のst.markdownで表示する
+GUIDE_SECTIONS = [
+    (
+        "\n\n".join([
+            "このアプリは、アンケートデータをアップロードするだけで、様々な統計分析と可視化を簡単に行うことができます。",
+            "---",
+            "### ステップ 1: データの準備",
+            "1. まず、サイドバーの「**1. データ準備**」セクションを確認してください。",
+            "2. 「**CSVファイルをアップロードしてください**」ボタンをクリックし、分析したいアンケートデータをCSV形式でアップロードします。",
+            "   - **💡 ヒント**: CSVファイルは、1行目が項目名（ヘッダー）で、各列が数値データやカテゴリデータになっていることを確認してください。",
+            "3. もし手元にデータがない場合は、「**サンプルCSVをダウンロード**」ボタンからサンプルデータをダウンロードして試すことができます。",
+            "4. ファイルがアップロードされると、「**アップロードしたデータのプレビュー**」を展開して、データが正しく読み込まれているか確認できます。",
+            "---",
+            "### ステップ 2: 分析タブの選択",
+            "データがアップロードされると、メイン画面の上部に5つの分析タブが表示されます。",
+            "- **① 記述統計**: データの基本的な特徴（平均、中央値、ばらつきなど）を把握します。",
+            "- **② 段階評価分析**: 1〜5段階評価などの項目について、回答の割合を円グラフで可視化します。",
+            "- **③ クロス集計**: 2つのカテゴリ変数の関係性を表とグラフで確認します。",
+            "- **④ 群間比較**: 複数のグループ間で数値データに統計的に意味のある差があるか検定します。",
+            "- **⑤ 前後比較**: 同じ対象の介入前後での数値データに変化があったか検定します。",
+        ]),
+        "https://i.imgur.com/rtWrnCP.png",
+        "分析タブのイメージ",
+    ),
+    (
+        "\n\n".join([
+            "---",
+            "### ステップ 3: 各分析の実行",
+            "各タブをクリックして、以下の手順で分析を進めます。",
+            "#### ① 記述統計",
+            "1. 「**分析したい数値列を選択してください**」で、平均値や標準偏差などを計算したい列を選びます。複数選択可能です。",
+            "2. 選択すると、要約統計量（平均、中央値、標準偏差、最小値、最大値など）の表が表示されます。",
+            "3. グラフとして、**平均値の比較**（棒グラフ）と**データの分布**（箱ひげ図）が表示され、視覚的にデータの傾向を把握できます。",
+        ]),
+        "https://i.imgur.com/koPRgx8.png",
+        "記述統計のイメージ",
+    ),
+    (
+        "\n\n".join([
+            "#### ② 段階評価分析",
+            "1. 「**分析したい段階評価の列を選択してください**」で、「満足度」のような1〜5段階評価の数値列を選びます。",
+            "2. 必要に応じて、「**グループ分けに使う列を選択してください（任意）**」で、「所属」などのカテゴリ列を選ぶと、グループごとの評価割合を比較できます。",
+            "3. 円グラフと集計表で、各評価段階の割合を確認できます。",
+        ]),
+        "https://i.imgur.com/vmJzyt5.png",
+        "段階評価分析のイメージ",
+    ),
+    (
+        "\n\n".join([
+            "#### ③ クロス集計",
+            "1. 「**行に使うカテゴリ列**」と「**列に使うカテゴリ列**」で、関係性を知りたい2つのカテゴリ列を選びます。",
+            "2. 選ぶとすぐにクロス集計表が表示され、各カテゴリの組み合わせごとの件数を確認できます。",
+            "3. 「**グラフの種類を選択**」で「積み上げ棒グラフ」または「グループ化棒グラフ」を選び、視覚的に傾向を比較します。",
+        ]),
+        "https://i.imgur.com/YBemVdK.png",
+        "クロス集計のイメージ",
+    ),
+    (
+        "\n\n".join([
+            "#### ④ 群間比較：2群または多群の比較",
+            "1. 「**グループ分けに使う列**」で、比較したいグループ（例: 「所属」）の列を選びます。",
+            "2. 「**比較する数値データ列**」で、グループ間で比較したい数値データ（例: 「業務知識テスト（事後）」）を選びます。",
+            "3. 自動的に箱ひげ図が表示され、各グループのデータの分布を確認できます。",
+            "4. グループの数に応じて、適切な統計検定（2群ならt検定/U検定、3群以上なら分散分析/クラスカル・ウォリス検定）が提案されます。",
+            "5. 提案された検定方法を選択し、検定結果（検定統計量、p値）と統計的な結論（有意差があるか否か）を確認します。",
+            "   - **💡 ヒント**: p値が0.05未満であれば「有意な差がある」と判断されます。",
+        ]),
+        "https://i.imgur.com/LXgRyk9.png",
+        "群間比較のイメージ",
+    ),
+    (
+        "\n\n".join([
+            "#### ⑤ 前後比較：対応のある検定",
+            "1. 「**事前（Before）データ列**」と「**事後（After）データ列**」で、比較したい2つの数値データ列（例: 「業務知識テスト（事前）」と「業務知識テスト（事後）」）を選びます。",
+            "2. 「**使用する検定**」で「対応のあるt検定」または「ウィルコクソン符号順位検定」を選択します。",
+            "3. 検定結果（検定統計量、p値）と統計的な結論（有意な変化があったか否か）が表示されます。",
+            "4. 事前・事後の平均値を比較する棒グラフも表示されます。",
+        ]),
+        "https://i.imgur.com/5sS5n4A.png",
+        "前後比較のイメージ",
+    ),
+    (
+        "\n\n".join([
+            "---",
+            "### ステップ 4: 結果のダウンロードと統計用語の確認",
+            "各分析結果の表には、「📄 この表をCSVでダウンロード」ボタンがついており、結果をCSVファイルとして保存できます。",
+            "メイン画面下部にある「**📖 統計用語の簡単な説明**」を展開すると、p値や平均値などの統計用語について学ぶことができます。",
+        ]),
+        None,
+        None,
+    ),
+]
+
+# --- 定数 ---
+MWU_EXACT_MAX_N = 8 # U検定でこの件数以下の群があればSciPyの正確検定を使う
+CATEGORY_MAX_RATIO = 0.5 # 種類数/行数 がこの値未満の文字列列はカテゴリ型に変換する
+BOX_ALL_POINTS_MAX_ROWS = 2000 # 箱ひげ図を全データ点つきで描く最大行数（これ以上は要約統計量と外れ値だけで描く）
+BOX_MAX_OUTLIER_POINTS = 500 # 要約統計量で描く箱ひげ図で、グループごとに表示する外れ値の最大点数
+UPLOAD_CACHE_MAX_ENTRIES = 4 # 読み込んだCSVをメモリに保持する最大件数（1件が大きいので少なめにする）
+CACHE_MAX_ENTRIES = 32 # 集計・検定・グラフのキャッシュごとに保持する最大件数（全セッションで共有するメモリの上限）
+
 # --- 関数定義 ---
+# 個人情報を含むアンケートをディスクに残さないよう、キャッシュはメモリ上だけに持つ
+@st.cache_data(show_spinner=False, max_entries=UPLOAD_CACHE_MAX_ENTRIES)
+def load_csv(file_bytes: bytes, category_max_ratio: float):
+    """アップロードされたCSVを読み込み、(データ, 数値列のリスト, カテゴリ列のリスト) を返す関数（同じファイルは再解析しない）"""
+    df = None
+    try:
+        # 高速なPyArrowエンジンで読み込む
+        df = pd.read_csv(io.BytesIO(file_bytes), engine="pyarrow")
+    except (ImportError, ValueError):
+        pass
+    if df is None or df.columns.has_duplicates:
+        # PyArrowが使えない・解析できない形式の場合や、列名が重複している場合は標準エンジンで読み込む
+        # （PyArrowは重複した列名をそのまま残すが、標準エンジンは a, a.1 のように区別できる名前に変える）
+        df = pd.read_csv(io.BytesIO(file_bytes))
+    # 整数列を最小の整数型に、種類の少ない文字列列をカテゴリ型に変換する（以降の集計を軽くする）
+    # 閾値は引数で受け取り、値を変えたときに古い変換結果のキャッシュが使われないようにする
+    for c in df.select_dtypes(include="integer").columns:
+        df[c] = pd.to_numeric(df[c], downcast="integer")
+    if len(df) > 0:
+        for c in df.select_dtypes(include=["object", "string"]).columns: # pandas 3 では文字列列は string 型
+            if df[c].nunique() / len(df) < category_max_ratio:
+                df[c] = df[c].astype("category")
+    # 列タイプも読み込みと一緒に判定してキャッシュする
+    numeric_cols = df.select_dtypes(include=np.number).columns.tolist()
+    cat_cols = df.select_dtypes(include=["object", "string", "category"]).columns.tolist()
+    return df, numeric_cols, cat_cols
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def paired_values(_df, data_key, col_pre, col_post):
+    """事前・事後の列を (行数, 2) のfloat64配列にまとめ、どちらかが欠損している行を除いて返す関数（データの内容ハッシュと列の組み合わせでキャッシュ）"""
+    # 選択された2列だけをfloat64に変換する（全数値列を前もって変換して保持しない）
+    arr = _df[[col_pre, col_post]].to_numpy(dtype=np.float64)
+    return arr[~np.isnan(arr).any(axis=1)]
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def sorted_uniques(_df, data_key, col):
+    """列の値の種類をソートして返す関数（欠損値は除く。データの内容ハッシュと列名でキャッシュ）"""
+    s = _df[col]
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        # 読み込み時にカテゴリ型にした列は、カテゴリがすでにソート済み
+        return s.cat.categories.tolist()
+    return sorted(s.dropna().unique())
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def describe_numeric(_df, data_key, cols: tuple):
+    """describe()と中央値を1回の配列走査でまとめて計算する関数（データの内容ハッシュと選択列ごとにキャッシュ）"""
+    cols = list(cols)
+    # 列ごとの集計なので、各列がメモリ上で連続する列優先（Fortran順）の配列にする（すでにそうなら複製しない）
+    arr = np.asfortranarray(_df[cols].to_numpy(dtype=np.float64))
+    if arr.shape[0] == 0:
+        # データが0行のときは、describe()と同様に件数0・それ以外はNaNの表を返す
+        desc = pd.DataFrame(np.nan, index=cols, columns=["count", "mean", "std", "min", "25%", "50%", "75%", "max", "median"])
+        desc["count"] = 0.0
+        return desc
+    with warnings.catch_warnings():
+        # 全て欠損の列はdescribe()と同様にNaNとして扱う
+        warnings.simplefilter("ignore", RuntimeWarning)
+        count = np.sum(~np.isnan(arr), axis=0).astype(np.float64)
+        mean = np.nanmean(arr, axis=0)
+        std = np.nanstd(arr, axis=0, ddof=1)
+        q = np.nanpercentile(arr, [0, 25, 50, 75, 100], axis=0)
+    return pd.DataFrame({
+        "count": count, "mean": mean, "std": std,
+        "min": q[0], "25%": q[1], "50%": q[2], "75%": q[3], "max": q[4],
+        "median": q[2],
+    }, index=cols)
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def box_from_stats(desc):
+    """要約統計量（最小値・四分位数・最大値）から箱ひげ図を作成する関数（全データ点をブラウザに送らない。ひげは最小値〜最大値）"""
+    fig = go.Figure()
+    for col, row in desc.iterrows():
+        fig.add_trace(go.Box(
+            x=[col], name=col,
+            q1=[row["25%"]], median=[row["50%"]], q3=[row["75%"]],
+            lowerfence=[row["min"]], upperfence=[row["max"]],
+        ))
+    fig.update_layout(title='箱ひげ図（ひげ: 最小値〜最大値）', showlegend=False, xaxis_title="項目", yaxis_title="値")
+    return fig
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def split_by_group(_df, data_key, group_col, value_col):
+    """グループ列で数値列を分割し、(ソート済みのグループ名, グループごとの配列) を返す関数（データの内容ハッシュと列の組み合わせごとにキャッシュ）"""
+    codes, uniques = pd.factorize(_df[group_col], sort=True) # 欠損しているグループは -1
+    values = _df[value_col].to_numpy(dtype=np.float64) # 選択された数値列だけをfloat64に変換する
+    valid = (codes >= 0) & ~np.isnan(values)
+    codes, values = codes[valid], values[valid]
+    if len(codes) == 0:
+        return [], []
+    # グループ番号で1回だけ並べ替え、各グループの件数の累積和の位置で分割する（グループごとのマスク走査をしない）
+    order = np.argsort(codes, kind="stable")
+    sizes = np.bincount(codes, minlength=len(uniques))
+    samples = np.split(values[order], np.cumsum(sizes)[:-1])
+    # 数値が全て欠損しているグループ（件数0）は除外する
+    present = np.flatnonzero(sizes)
+    return [uniques[i] for i in present], [samples[i] for i in present]
+
+def run_ttest_ind(a: np.ndarray, b: np.ndarray):
+    """ウェルチのt検定"""
+    from scipy import stats # 検定を実行するときだけ読み込む
+    stat, p = stats.ttest_ind(a, b, equal_var=False)
+    return float(stat), float(p)
+
+def run_mannwhitneyu(a: np.ndarray, b: np.ndarray):
+    """マン・ホイットニーのU検定"""
+    from scipy import stats # 検定を実行するときだけ読み込む
+    n1, n2 = len(a), len(b)
+    if n1 <= MWU_EXACT_MAX_N or n2 <= MWU_EXACT_MAX_N:
+        # 小標本ではSciPyの正確検定に任せる
+        stat, p = stats.mannwhitneyu(a, b, alternative="two-sided")
+        return float(stat), float(p)
+
+    # 大標本では順位和から U = R1 - n1(n1+1)/2 を求め、正規近似（同順位・連続性補正あり）でp値を計算する
+    ranks = stats.rankdata(np.concatenate([a, b]))
+    u1 = ranks[:n1].sum() - n1 * (n1 + 1) / 2
+    u = max(u1, n1 * n2 - u1)
+    n = n1 + n2
+    _, ties = np.unique(ranks, return_counts=True)
+    tie_term = np.sum(ties.astype(np.float64) ** 3 - ties)
+    sigma = np.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = (u - n1 * n2 / 2 - 0.5) / sigma
+    p = min(2 * stats.norm.sf(z), 1.0)
+    return float(u1), float(p)
+
+def run_ttest_rel(before: np.ndarray, after: np.ndarray):
+    """対応のあるt検定"""
+    from scipy import stats # 検定を実行するときだけ読み込む
+    stat, p = stats.ttest_rel(before, after)
+    return float(stat), float(p)
+
+def run_wilcoxon(before: np.ndarray, after: np.ndarray):
+    """ウィルコクソン符号順位検定"""
+    from scipy import stats # 検定を実行するときだけ読み込む
+    stat, p = stats.wilcoxon(before, after)
+    return float(stat), float(p)
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def run_anova(_samples, data_key, group_col, value_col):
+    """一元配置分散分析（結果はデータの内容ハッシュと列の組み合わせでキャッシュ）"""
+    from scipy import stats # 検定を実行するときだけ読み込む
+    stat, p = stats.f_oneway(*_samples)
+    return float(stat), float(p)
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def run_kruskal(_samples, data_key, group_col, value_col):
+    """クラスカル・ウォリス検定（結果はデータの内容ハッシュと列の組み合わせでキャッシュ）"""
+    from scipy import stats # 検定を実行するときだけ読み込む
+    stat, p = stats.kruskal(*_samples)
+    return float(stat), float(p)
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def run_posthoc_tukey(_samples, _groups, data_key, group_col, value_col):
+    """Tukey-HSD法による多重比較のp値表（結果はデータの内容ハッシュと列の組み合わせでキャッシュ）"""
+    from statsmodels.stats.multicomp import pairwise_tukeyhsd # 多重比較を実行するときだけ読み込む
+    # split_by_groupで分割済みの配列を連結し、グループ名の代わりに整数のグループ番号を渡す（文字列を再度分類しない）
+    values = np.concatenate(_samples)
+    codes = np.repeat(np.arange(len(_samples)), [len(x) for x in _samples])
+    # 全ての組み合わせをstatsmodelsで一度に計算し、グループ×グループの対称なp値表に並べ直す
+    res = pairwise_tukeyhsd(values, codes)
+    return tukey_to_df(res.pvalues, [_groups[i] for i in res.groupsunique])
+
+def tukey_to_df(pvalues, groups):
+    """組み合わせ順に並んだp値を、対角が1の対称なp値表に変換する関数"""
+    k = len(groups)
+    mat = np.ones((k, k))
+    rows, cols = np.triu_indices(k, k=1) # itertools.combinations と同じ順序
+    mat[rows, cols] = pvalues
+    mat[cols, rows] = pvalues
+    return pd.DataFrame(mat, index=list(groups), columns=list(groups))
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def run_posthoc_dunn(_samples, _groups, data_key, group_col, value_col):
+    """Dunn法（Holm補正）による多重比較のp値表（結果はデータの内容ハッシュと列の組み合わせでキャッシュ）"""
+    import scikit_posthocs as sp # 多重比較を実行するときだけ読み込む
+    # 分割済みの配列をそのまま渡し、1始まりの番号で返る行・列をグループ名に戻す
+    p_values = sp.posthoc_dunn(_samples, p_adjust='holm')
+    p_values.index = list(_groups)
+    p_values.columns = list(_groups)
+    return p_values
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def compute_crosstab(_df, data_key, row_col, col_col):
+    """クロス集計表を作成する関数（データの内容ハッシュと列の組み合わせごとにキャッシュ）"""
+    return pd.crosstab(_df[row_col], _df[col_col])
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def two_sample_tests(_a: np.ndarray, _b: np.ndarray, data_key, group_col, value_col):
+    """t検定とU検定をまとめて実行する関数（検定方法を切り替えても再計算しない。データの内容ハッシュと列の組み合わせでキャッシュ）"""
+    return {"t": run_ttest_ind(_a, _b), "u": run_mannwhitneyu(_a, _b)}
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def paired_tests(_before: np.ndarray, _after: np.ndarray, data_key, col_pre, col_post):
+    """対応のあるt検定とウィルコクソン符号順位検定をまとめて実行する関数（データの内容ハッシュと列名でキャッシュ）"""
+    return {"t": run_ttest_rel(_before, _after), "wilcoxon": run_wilcoxon(_before, _after)}
+
+# --- グラフ作成（同じ入力なら作成済みの図を再利用） ---
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def make_bar_desc(df_mean):
+    """各項目の平均値の棒グラフ"""
+    fig = px.bar(
+        df_mean, x='項目', y='平均値', title='各項目の平均値',
+        color='項目', text_auto=True
+    )
+    fig.update_traces(textposition='outside')
+    fig.update_layout(showlegend=False, yaxis_title="平均値")
+    return fig
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def make_pie(df_pie, names_col, title):
+    """回答割合の円グラフ（ドーナツグラフ）"""
+    fig = px.pie(
+        df_pie,
+        names=names_col,
+        values='人数',
+        title=title,
+        hole=0.3 # ドーナツグラフにする
+    )
+    fig.update_traces(textposition='inside', textinfo='percent+label', sort=False)
+    return fig
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def make_crosstab_bar(cross_tab, barmode, title, row_col):
+    """クロス集計の棒グラフ（積み上げ/グループ化）"""
+    fig = px.bar(cross_tab, barmode=barmode, title=title)
+    fig.update_layout(xaxis_title=row_col, yaxis_title="件数")
+    return fig
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def make_box(_df, _samples, data_key, group_col, value_col, order, title):
+    """グループ別の箱ひげ図（データの内容ハッシュと列の組み合わせでキャッシュ）"""
+    if sum(len(x) for x in _samples) < BOX_ALL_POINTS_MAX_ROWS:
+        # 全データ点を重ねて表示
+        return px.box(_df[[group_col, value_col]].dropna(), x=group_col, y=value_col, color=group_col,
+                      title=title, points="all",
+                      category_orders={group_col: order})
+    # データが多いときは、Plotlyに全データを渡すとブラウザに送るデータ量が行数に比例して増えるため、
+    # split_by_groupで分割済みのグループごとの配列から四分位数とひげの位置を計算し、外れ値だけを点で重ねる
+    fig = go.Figure()
+    colors = px.colors.qualitative.Plotly
+    for i, (group, x) in enumerate(zip(order, _samples)):
+        q1, median, q3 = np.percentile(x, [25, 50, 75])
+        iqr = q3 - q1
+        # ひげはPlotlyの既定と同じく、箱から四分位範囲の1.5倍以内にある最も外側のデータ点まで
+        inside = (x >= q1 - 1.5 * iqr) & (x <= q3 + 1.5 * iqr)
+        lower = x[inside].min()
+        upper = x[inside].max()
+        color = colors[i % len(colors)]
+        fig.add_trace(go.Box(
+            x=[group], name=str(group), marker_color=color, legendgroup=str(group),
+            q1=[q1], median=[median], q3=[q3],
+            lowerfence=[lower], upperfence=[upper],
+        ))
+        outliers = np.sort(x[~inside])
+        if len(outliers) == 0:
+            continue
+        if len(outliers) > BOX_MAX_OUTLIER_POINTS:
+            # 外れ値が多いときは、最小・最大を含めて値の順に等間隔で間引く
+            outliers = outliers[np.linspace(0, len(outliers) - 1, BOX_MAX_OUTLIER_POINTS).round().astype(int)]
+        fig.add_trace(go.Scatter(
+            x=[group] * len(outliers), y=outliers, mode="markers",
+            marker=dict(color=color, size=4), name=f"{group} 外れ値",
+            legendgroup=str(group), showlegend=False,
+        ))
+    fig.update_layout(title=title, xaxis_title=group_col, yaxis_title=value_col, legend_title_text=group_col)
+    return fig
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def make_bar_prepost(df_plot):
+    """事前・事後の平均値の棒グラフ"""
+    fig = px.bar(df_plot, y='平均値', color=df_plot.index, title='事前・事後の平均値比較', text_auto=True)
+    fig.update_traces(textposition='outside')
+    return fig
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def make_pvalue_heatmap(p_values_df):
+    """多重比較のp値表のヒートマップ（p < 0.05 のセルを緑で表示）"""
+    fig = px.imshow(
+        p_values_df, text_auto='.4f', zmin=0, zmax=1,
+        # 0〜0.05 を緑、それ以上を白で塗り分ける
+        color_continuous_scale=[[0, '#aaffaa'], [0.05, '#aaffaa'], [0.05, '#ffffff'], [1, '#ffffff']],
+    )
+    fig.update_layout(coloraxis_showscale=False, xaxis_title="", yaxis_title="")
+    fig.update_xaxes(side="top")
+    return fig
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def to_csv_bytes(df) -> bytes:
+    """表をCSVのバイト列に変換する関数（同じ表は再変換しない）"""
+    return df.to_csv(index=True).encode('utf-8-sig')
+
 def df_to_csv_download_button(df, filename):
     """CSVダウンロードボタンを生成する関数"""
-    csv = df.to_csv(index=True).encode('utf-8-sig')
     st.download_button(
         label="📄 この表をCSVでダウンロード",
-        data=csv,
+        data=to_csv_bytes(df),
         file_name=f'{filename}.csv',
         mime='text/csv',
     )
 
-# --- フォント設定 (日本語対応) ---
-# font_path = os.path.abspath("ipaexg.ttf") # ローカル環境でフォントファイルを置く場合
-# if os.path.exists(font_path):
-#     font_prop = fm.FontProperties(fname=font_path)
-#     mpl.rcParams["font.family"] = font_prop.get_name()
-#     plt.rc("font", family=font_prop.get_name())
-# else:
-#     # フォントファイルがない場合でもアプリは動作するが、Matplotlibの日本語が文字化けする
-#     st.warning("⚠️ 日本語フォントファイルが見つかりません。Matplotlibを使ったグラフの日本語が文字化けする可能性があります。")
-
-
-# --- サイドバー ---
-with st.sidebar:
-    st.header("1. データ準備")
-    uploaded_file = st.file_uploader("CSVファイルをアップロードしてください", type="csv")
-    
-    if uploaded_file:
-        st.success(f"✅ ファイルがアップロードされました: `{uploaded_file.name}`")
-
-    st.subheader("📥 サンプルCSVのダウンロード")
-    sample_data = {
-        "氏名": ["山田太郎", "佐藤花子", "鈴木一郎", "田中次郎", "高橋三郎", "伊藤さくら", "渡辺健太", "中村恵美", "小林直樹"],
-        "所属": ["営業部", "開発部", "人事部", "開発部", "営業部", "人事部", "開発部", "営業部", "人事部"],
-        "性別": ["男性", "女性", "男性", "男性", "男性", "女性", "男性", "女性", "男性"],
-        "研修満足度": [3, 5, 4, 5, 2, 4, 4, 3, 5],
-        "講師満足度": [4, 5, 5, 4, 3, 5, 4, 4, 5],
-        "業務知識テスト（事前）": [60, 55, 58, 70, 65, 62, 80, 59, 68],
-        "業務知識テスト（事後）": [75, 85, 72, 88, 78, 80, 92, 75, 85]
-    }
-    df_sample = pd.DataFrame(sample_data)
-    csv = df_sample.to_csv(index=False).encode("utf-8-sig")
-    st.download_button(
-        label="📄 サンプルCSVをダウンロード",
-        data=csv,
-        file_name="sample_survey_multi_group.csv",
-        mime="text/csv"
-    )
-
-    st.header("2. このアプリについて")
-    with st.expander("各分析手法の簡単な説明", expanded=False):
-        st.markdown("""
-        #### 🔍 記述統計
-        データの平均、中央値、ばらつき（標準偏差）などを計算し、データ全体の基本的な特徴を把握します。
-        
-        #### 📊 段階評価分析
-        「満足度」など、1〜5段階で評価された項目について、回答の割合を円グラフで可視化します。「所属」などのカテゴリ別に割合を見ることもできます。
-
-        #### 🔄 クロス集計
-        「所属」と「性別」など、2つのカテゴリの関係性を表にまとめ、グループごとの傾向を視覚化します。
-        
-        #### ⚖️ 群間比較
-        「営業部」「開発部」「人事部」のように、複数のグループ間で特定の数値に統計的に意味のある差（有意差）があるかを検定します。
-        - **2グループの場合**: t検定やU検定を用います。
-        - **3グループ以上の場合**: **分散分析 (ANOVA)** やクラスカル・ウォリス検定を用います。
-        
-        *このアプリでは、グループ数を自動で判別して適切な手法を提案します。*
-        
-        #### ⏱ 前後比較
-        研修の前後など、同じ対象の状況が変化したかを統計的に検定します。
-        """)
-
-    # --- 使い方ガイドボタンの追加 ---
-    st.markdown("---")
-    st.subheader("💡 使い方ガイド")
-    col_guide_btn1, col_guide_btn2 = st.columns(2)
-    with col_guide_btn1:
-        if st.button("📚 アプリの使い方を見る", help="アプリの操作方法をステップバイステップで説明します。", key="open_guide_sidebar"):
-            st.session_state["show_guide"] = True
-    with col_guide_btn2:
-        # ガイドが開いている場合のみ「閉じる」ボタンを表示
-        if st.session_state.get("show_guide", False):
-            if st.button("❌ ガイドを閉じる", help="使い方ガイドを閉じます。", key="close_guide_sidebar"):
-                st.session_state["show_guide"] = False
-
-
-# --- メイン画面 ---
-st.title("📊 アンケートデータ統計分析アプリ")
-st.write("アップロードしたCSVデータの簡単な統計分析と可視化を行います。")
-
-# 使い方ガイドの表示
-if st.session_state.get("show_guide", False):
+@st.fragment
+def render_guide():
+    """使い方ガイドを表示する関数（ガイド内の操作ではこの部分だけを再実行）"""
     st.markdown("## 📚 使い方ガイド：アンケートデータ統計分析アプリ")
     
     # ガイドを閉じるボタンを上部に配置
     if st.button("❌ ガイドを閉じる", help="使い方ガイドを閉じます。", key="close_guide_main_top"):
-        st.session_state["show_guide"] = False
-    
-    st.markdown("このアプリは、アンケートデータをアップロードするだけで、様々な統計分析と可視化を簡単に行うことができます。")
-    st.markdown("---")
-
-    st.markdown("### ステップ 1: データの準備")
-    st.markdown("1. まず、サイドバーの「**1. データ準備**」セクションを確認してください。")
-    st.markdown("2. 「**CSVファイルをアップロードしてください**」ボタンをクリックし、分析したいアンケートデータをCSV形式でアップロードします。")
-    st.markdown("   - **💡 ヒント**: CSVファイルは、1行目が項目名（ヘッダー）で、各列が数値データやカテゴリデータになっていることを確認してください。")
-    st.markdown("3. もし手元にデータがない場合は、「**サンプルCSVをダウンロード**」ボタンからサンプルデータをダウンロードして試すことができます。")
-    st.markdown("4. ファイルがアップロードされると、「**アップロードしたデータのプレビュー**」を展開して、データが正しく読み込まれているか確認できます。")
+        close_guide()
     
-    
-    st.markdown("---")
-
-    st.markdown("### ステップ 2: 分析タブの選択")
-    st.markdown("データがアップロードされると、メイン画面の上部に5つの分析タブが表示されます。")
-    st.markdown("- **① 記述統計**: データの基本的な特徴（平均、中央値、ばらつきなど）を把握します。")
-    st.markdown("- **② 段階評価分析**: 1〜5段階評価などの項目について、回答の割合を円グラフで可視化します。")
-    st.markdown("- **③ クロス集計**: 2つのカテゴリ変数の関係性を表とグラフで確認します。")
-    st.markdown("- **④ 群間比較**: 複数のグループ間で数値データに統計的に意味のある差があるか検定します。")
-    st.markdown("- **⑤ 前後比較**: 同じ対象の介入前後での数値データに変化があったか検定します。")
-    with st.expander("分析タブのイメージを表示"):
-        st.image("https://i.imgur.com/rtWrnCP.png", caption="分析タブのイメージ") 
-
-    st.markdown("---")
-
-    st.markdown("### ステップ 3: 各分析の実行")
-    st.markdown("各タブをクリックして、以下の手順で分析を進めます。")
-
-    st.markdown("#### ① 記述統計")
-    st.markdown("1. 「**分析したい数値列を選択してください**」で、平均値や標準偏差などを計算したい列を選びます。複数選択可能です。")
-    st.markdown("2. 選択すると、要約統計量（平均、中央値、標準偏差、最小値、最大値など）の表が表示されます。")
-    st.markdown("3. グラフとして、**平均値の比較**（棒グラフ）と**データの分布**（箱ひげ図）が表示され、視覚的にデータの傾向を把握できます。")
-    with st.expander("記述統計のイメージを表示"):
-        st.image("https://i.imgur.com/koPRgx8.png", caption="記述統計のイメージ") 
-
-    st.markdown("#### ② 段階評価分析")
-    st.markdown("1. 「**分析したい段階評価の列を選択してください**」で、「満足度」のような1〜5段階評価の数値列を選びます。")
-    st.markdown("2. 必要に応じて、「**グループ分けに使う列を選択してください（任意）**」で、「所属」などのカテゴリ列を選ぶと、グループごとの評価割合を比較できます。")
-    st.markdown("3. 円グラフと集計表で、各評価段階の割合を確認できます。")
-    with st.expander("段階評価分析のイメージを表示"):
-        st.image("https://i.imgur.com/vmJzyt5.png", caption="段階評価分析のイメージ") 
-
-    st.markdown("#### ③ クロス集計")
-    st.markdown("1. 「**行に使うカテゴリ列**」と「**列に使うカテゴリ列**」で、関係性を知りたい2つのカテゴリ列を選びます。")
-    st.markdown("2. 選ぶとすぐにクロス集計表が表示され、各カテゴリの組み合わせごとの件数を確認できます。")
-    st.markdown("3. 「**グラフの種類を選択**」で「積み上げ棒グラフ」または「グループ化棒グラフ」を選び、視覚的に傾向を比較します。")
-    with st.expander("クロス集計のイメージを表示"):
-        st.image("https://i.imgur.com/YBemVdK.png", caption="クロス集計のイメージ") 
-
-    st.markdown("#### ④ 群間比較：2群または多群の比較")
-    st.markdown("1. 「**グループ分けに使う列**」で、比較したいグループ（例: 「所属」）の列を選びます。")
-    st.markdown("2. 「**比較する数値データ列**」で、グループ間で比較したい数値データ（例: 「業務知識テスト（事後）」）を選びます。")
-    st.markdown("3. 自動的に箱ひげ図が表示され、各グループのデータの分布を確認できます。")
-    st.markdown("4. グループの数に応じて、適切な統計検定（2群ならt検定/U検定、3群以上なら分散分析/クラスカル・ウォリス検定）が提案されます。")
-    st.markdown("5. 提案された検定方法を選択し、検定結果（検定統計量、p値）と統計的な結論（有意差があるか否か）を確認します。")
-    st.markdown("   - **💡 ヒント**: p値が0.05未満であれば「有意な差がある」と判断されます。")
-    with st.expander("群間比較のイメージを表示"):
-        st.image("https://i.imgur.com/LXgRyk9.png", caption="群間比較のイメージ") 
-
-    st.markdown("#### ⑤ 前後比較：対応のある検定")
-    st.markdown("1. 「**事前（Before）データ列**」と「**事後（After）データ列**」で、比較したい2つの数値データ列（例: 「業務知識テスト（事前）」と「業務知識テスト（事後）」）を選びます。")
-    st.markdown("2. 「**使用する検定**」で「対応のあるt検定」または「ウィルコクソン符号順位検定」を選択します。")
-    st.markdown("3. 検定結果（検定統計量、p値）と統計的な結論（有意な変化があったか否か）が表示されます。")
-    st.markdown("4. 事前・事後の平均値を比較する棒グラフも表示されます。")
-    with st.expander("前後比較のイメージを表示"):
-        st.image("https://i.imgur.com/5sS5n4A.png", caption="前後比較のイメージ") 
-
-    st.markdown("---")
-    st.markdown("### ステップ 4: 結果のダウンロードと統計用語の確認")
-    st.markdown("各分析結果の表には、「📄 この表をCSVでダウンロード」ボタンがついており、結果をCSVファイルとして保存できます。")
-    st.markdown("メイン画面下部にある「**📖 統計用語の簡単な説明**」を展開すると、p値や平均値などの統計用語について学ぶことができます。")
+    for guide_md, image_url, image_caption in GUIDE_SECTIONS:
+        st.markdown(guide_md)
+        if image_url:
+            with st.expander(f"{image_caption}を表示"):
+                st.image(image_url, caption=image_caption)
 
     st.markdown("---")
     st.success("これでアプリの使い方は終わりです！ ぜひご自身のデータで様々な分析を試してみてください。")
     # ガイドを閉じるボタンを再度表示（冗長性を考慮）
     if st.button("❌ ガイドを閉じる", help="使い方ガイドを閉じます。", key="close_guide_main_bottom"):
-        st.session_state["show_guide"] = False
-    
-    st.stop() # ガイド表示中はメインのアプリ本体は停止
+        close_guide()
 
-if not uploaded_file:
-    st.info("👆 サイドバーからCSVファイルをアップロードして分析を開始してください。")
-    st.stop()
-
-# --- ファイルがアップロードされた後の処理 ---
-try:
-    df = pd.read_csv(uploaded_file)
-    with st.expander("アップロードしたデータのプレビュー", expanded=False):
-        st.dataframe(df)
-except Exception as e:
-    st.error(f"❌ ファイルの読み込み中にエラーが発生しました: {e}")
-    st.stop()
+def close_guide():
+    """ガイドを閉じてアプリ全体を再実行する関数"""
+    st.session_state["show_guide"] = False
+    st.rerun() # フラグメント内から呼んでもアプリ全体を再実行する
 
 
-# 列タイプを自動で取得
-numeric_cols = df.select_dtypes(include=np.number).columns.tolist()
-cat_cols = df.select_dtypes(include=["object", "category"]).columns.tolist()
-
-# --- 分析タブ ---
-tab1, tab5, tab2, tab3, tab4 = st.tabs(["① 記述統計", "② 段階評価分析", "③ クロス集計", "④ 群間比較", "⑤ 前後比較"])
-
-# --- タブ1: 記述統計 ---
-with tab1:
+# --- 分析タブ（各タブはフラグメントにして、タブ内の操作ではそのタブだけを再実行） ---
+@st.fragment
+def render_tab1(df, numeric_cols, data_key):
+    """① 記述統計タブを表示する関数"""
     st.header("① 記述統計")
     st.write("データの基本的な特徴（平均、中央値、ばらつき等）を把握します。")
     selected_cols_desc = st.multiselect("分析したい数値列を選択してください", numeric_cols, default=numeric_cols[:min(len(numeric_cols), 3)])
 
     if selected_cols_desc:
-        desc = df[selected_cols_desc].describe().T
-        desc["median"] = df[selected_cols_desc].median() # 中央値を追加
+        desc = describe_numeric(df, data_key, tuple(selected_cols_desc)) # 中央値も含めて一括計算
         st.write("📋 **要約統計量**")
         st.dataframe(desc.style.format("{:.2f}"), use_container_width=True) # 小数点以下2桁に整形
         df_to_csv_download_button(desc, "descriptive_stats")
 
         st.write("📊 **各項目の可視化**")
         
-        df_mean = df[selected_cols_desc].mean().reset_index()
-        df_mean.columns = ['項目', '平均値']
-        df_melted = df[selected_cols_desc].melt(var_name='項目', value_name='値')
+        df_mean = desc["mean"].rename_axis('項目').reset_index(name='平均値') # 要約統計量の平均値を再利用
         
         col1, col2 = st.columns(2)
         with col1:
             st.subheader("平均値の比較")
-            fig_bar = px.bar(
-                df_mean, x='項目', y='平均値', title='各項目の平均値',
-                color='項目', text_auto=True
-            )
-            fig_bar.update_traces(textposition='outside')
-            fig_bar.update_layout(showlegend=False, yaxis_title="平均値")
+            fig_bar = make_bar_desc(df_mean)
             st.plotly_chart(fig_bar, use_container_width=True)
             
         with col2:
             st.subheader("データの分布")
-            fig_box = px.box(df_melted, x='項目', y='値', title='箱ひげ図', color='項目')
-            fig_box.update_layout(showlegend=False, yaxis_title="値")
+            fig_box = box_from_stats(desc)
             st.plotly_chart(fig_box, use_container_width=True)
+            st.write("_ひげは最小値から最大値までを表します（外れ値は区別していません）。_")
 
 # --- ★★★★★ ここからが追加した機能 ★★★★★ ---
-# --- タブ5: 段階評価分析 ---
-with tab5:
+@st.fragment
+def render_tab5(df, numeric_cols, cat_cols, data_key):
+    """② 段階評価分析タブを表示する関数"""
     st.header("② 段階評価分析")
     st.write("1〜5段階評価などのアンケート項目について、回答の割合を円グラフで可視化します。")
     st.info("💡 「研修満足度」などの整数で評価された数値列を選択してください。")
@@ -302,37 +539,34 @@ with tab5:
 
             with col2:
                 st.write("**円グラフ**")
-                fig_pie = px.pie(
-                    df_pie,
-                    names=pie_target_col,
-                    values='人数',
-                    title=f"「{pie_target_col}」の回答割合",
-                    hole=0.3 # ドーナツグラフにする
-                )
-                fig_pie.update_traces(textposition='inside', textinfo='percent+label', sort=False)
+                fig_pie = make_pie(df_pie, pie_target_col, f"「{pie_target_col}」の回答割合")
                 st.plotly_chart(fig_pie, use_container_width=True)
 
         # --- グループ別の集計 ---
         else:
             st.subheader(f"📊 「{pie_group_col}」別 - 「{pie_target_col}」の集計")
-            groups = sorted(df[pie_group_col].dropna().unique())
+            groups = sorted_uniques(df, data_key, pie_group_col)
+
+            # グループとターゲット列で欠損値を除外し、全グループの回答数を1回の集計で求める（行: グループ, 列: 回答）
+            pie_counts = (
+                df.dropna(subset=[pie_group_col, pie_target_col])
+                .groupby(pie_group_col, observed=True)[pie_target_col]
+                .value_counts()
+                .unstack(fill_value=0)
+            )
 
             for group in groups:
                 st.markdown(f"---")
                 st.markdown(f"#### **グループ: {group}**")
-                
-                # グループとターゲット列で欠損値を除外
-                df_filtered_pie = df.dropna(subset=[pie_group_col, pie_target_col])
-                df_filtered_pie = df_filtered_pie[df_filtered_pie[pie_group_col] == group]
 
-                if df_filtered_pie.empty:
+                if group not in pie_counts.index:
                     st.write("このグループには表示できるデータがありません。")
                     continue
 
-                # データ集計
-                df_counts = df_filtered_pie[pie_target_col].value_counts().sort_index()
-                df_pie = df_counts.reset_index()
-                df_pie.columns = [pie_target_col, '人数']
+                # データ集計（回答のなかった段階は除く）
+                df_counts = pie_counts.loc[group]
+                df_counts = df_counts[df_counts > 0]
+                df_pie = df_counts.rename_axis(pie_target_col).reset_index(name='人数')
 
                 col1, col2 = st.columns([1, 2])
                 with col1:
@@ -345,22 +579,16 @@ with tab5:
                     if df_pie.empty:
                          st.write("表示するデータがありません。")
                          continue
-                    fig_pie_group = px.pie(
-                        df_pie,
-                        names=pie_target_col,
-                        values='人数',
-                        title=f"「{pie_target_col}」の回答割合 ({group})",
-                        hole=0.3
-                    )
-                    fig_pie_group.update_traces(textposition='inside', textinfo='percent+label', sort=False)
+                    fig_pie_group = make_pie(df_pie, pie_target_col, f"「{pie_target_col}」の回答割合 ({group})")
                     st.plotly_chart(fig_pie_group, use_container_width=True)
     else:
         st.info("👆 分析したい列と、必要に応じてグループ分けの列を選択してください。")
 
 # --- ★★★★★ 追加機能はここまで ★★★★★ ---
 
-# --- タブ2: クロス集計 ---
-with tab2:
+@st.fragment
+def render_tab2(df, cat_cols, data_key):
+    """③ クロス集計タブを表示する関数"""
     st.header("③ クロス集計")
     st.write("2つのカテゴリ変数の関係性を表とグラフで確認します。")
     if len(cat_cols) < 2:
@@ -376,7 +604,7 @@ with tab2:
             if row_col == col_col:
                 st.warning("行と列には異なる列を選択してください。")
             else:
-                cross_tab = pd.crosstab(df[row_col], df[col_col])
+                cross_tab = compute_crosstab(df, data_key, row_col, col_col)
                 st.write(f"**「{row_col}」と「{col_col}」のクロス集計表**")
                 st.dataframe(cross_tab, use_container_width=True)
                 df_to_csv_download_button(cross_tab, f"crosstab_{row_col}_vs_{col_col}")
@@ -384,13 +612,34 @@ with tab2:
                 st.write("📊 **クロス集計の可視化**")
                 graph_type = st.radio("グラフの種類を選択", ["積み上げ棒グラフ", "グループ化棒グラフ"], horizontal=True, key="cross_graph_type")
                 barmode_option = 'stack' if graph_type == "積み上げ棒グラフ" else 'group'
-                
-                fig = px.bar(cross_tab, barmode=barmode_option, title=f"{graph_type}: {row_col} vs {col_col}")
-                fig.update_layout(xaxis_title=row_col, yaxis_title="件数")
+
+                fig = make_crosstab_bar(cross_tab, barmode_option, f"{graph_type}: {row_col} vs {col_col}", row_col)
                 st.plotly_chart(fig, use_container_width=True)
 
-# --- タブ3: 群間比較 ---
-with tab3:
+def display_posthoc_results(p_values_df):
+    """多重比較のp値表と、有意差のある組み合わせの要約を表示する関数"""
+    st.write("**p値の比較表（p < 0.05 の組み合わせをハイライト）**")
+    # セルごとにPythonの関数を呼ぶStylerを使わず、ヒートマップで塗り分ける
+    st.plotly_chart(make_pvalue_heatmap(p_values_df), use_container_width=True)
+
+    # 対角より下（各組み合わせにつき1回）で p < 0.05 のセルを判定
+    significant = np.tril(p_values_df.to_numpy() < 0.05, k=-1)
+
+    st.markdown("---")
+    st.write("#### **結論の要約**")
+    if not significant.any():
+        st.info("いずれのグループの組み合わせにおいても、統計的に有意な差は見られませんでした。")
+        return
+
+    # 有意な組み合わせがあるときだけ、グループ名を取り出す
+    col_idx, row_idx = np.nonzero(significant.T) # 列ごとの順序で取り出す
+    st.success("以下のグループの組み合わせで、統計的に有意な差が見られました。")
+    for i, j in zip(col_idx, row_idx):
+        st.markdown(f"- **{p_values_df.columns[i]}** と **{p_values_df.index[j]}**")
+
+@st.fragment
+def render_tab3(df, numeric_cols, cat_cols, data_key):
+    """④ 群間比較タブを表示する関数"""
     st.header("④ 群間比較：2群または多群の比較")
     st.write("選択したグループ間で、数値データに統計的に意味のある差（有意差）があるか検定します。")
     st.write("_グループ数が2つの場合はt検定/U検定を、3つ以上の場合は分散分析/クラスカル・ウォリス検定を自動的に実行します。_")
@@ -402,17 +651,16 @@ with tab3:
         value_col = st.selectbox("比較する数値データ列", numeric_cols, key="test2_multi")
 
     if not group_col or not value_col:
-        st.stop()
+        return
 
-    df_filtered = df[[group_col, value_col]].dropna()
-    groups = sorted(df_filtered[group_col].unique()) # グループ名をソートして順序を固定
+    # グループ分けは一度だけ行い、グラフの順序と検定の両方で使い回す
+    groups, group_samples = split_by_group(df, data_key, group_col, value_col)
     group_count = len(groups)
 
     st.subheader("📊 箱ひげ図による可視化")
-    fig = px.box(df_filtered, x=group_col, y=value_col, color=group_col,
-                 title=f"{group_col}別 {value_col}の分布", points="all",
-                 category_orders={group_col: groups}) # グラフの順序も固定
+    fig = make_box(df, group_samples, data_key, group_col, value_col, groups, f"{group_col}別 {value_col}の分布") # グラフの順序も固定
     st.plotly_chart(fig, use_container_width=True)
+    st.write("_ひげは箱から四分位範囲の1.5倍以内にある最も外側のデータまでを表し、それより外側の点は外れ値です。_")
 
     st.markdown("---")
 
@@ -421,17 +669,17 @@ with tab3:
 
     elif group_count == 2:
         st.subheader("検定方法の選択（2群）")
-        g1 = df_filtered[df_filtered[group_col] == groups[0]][value_col]
-        g2 = df_filtered[df_filtered[group_col] == groups[1]][value_col]
+        g1, g2 = group_samples
         
         test_type = st.radio("検定方法の選択", ["t検定（平均値の差）", "U検定（分布の差）"], horizontal=True, key="2group_test")
+        test_results = two_sample_tests(g1, g2, data_key, group_col, value_col)
         
         if "t検定" in test_type:
             st.info("_💡 **t検定**: 2つのグループの**平均値**に差があるか検定します。データが正規分布に近い場合に適しています。_")
-            stat, p = stats.ttest_ind(g1, g2, equal_var=False)
+            stat, p = test_results["t"]
         else:
             st.info("_💡 **U検定**: 2つのグループの**分布**に差があるか検定します。データが正規分布に従わない場合や、順序尺度の場合に用います。_")
-            stat, p = stats.mannwhitneyu(g1, g2, alternative="two-sided")
+            stat, p = test_results["u"]
 
         st.subheader("検定結果")
         res_col1, res_col2 = st.columns(2)
@@ -445,34 +693,13 @@ with tab3:
 
     else: # 3群以上の比較
         st.subheader(f"検定方法の選択（{group_count}群）")
-        samples = [df_filtered[df_filtered[group_col] == g][value_col] for g in groups]
+        samples = group_samples # split_by_groupで分割済みの配列をそのまま使う
         
         test_type_multi = st.radio("検定方法の選択", ["分散分析ANOVA（平均値の差）", "クラスカル・ウォリス検定（分布の差）"], horizontal=True, key="multi_group_test")
         
-        def display_posthoc_results(p_values_df):
-            st.write("**p値の比較表（p < 0.05 の組み合わせをハイライト）**")
-            st.dataframe(p_values_df.style.applymap(lambda x: 'background-color: #aaffaa' if x < 0.05 else ''))
-            
-            significant_pairs = []
-            for i, col in enumerate(p_values_df.columns):
-                for j, row_label in enumerate(p_values_df.index):
-                    if i < j:
-                        p_val = p_values_df.iloc[j, i]
-                        if p_val < 0.05:
-                            significant_pairs.append(f"**{col}** と **{row_label}**")
-            
-            st.markdown("---")
-            st.write("#### **結論の要約**")
-            if significant_pairs:
-                st.success("以下のグループの組み合わせで、統計的に有意な差が見られました。")
-                for pair in significant_pairs:
-                    st.markdown(f"- {pair}")
-            else:
-                st.info("いずれのグループの組み合わせにおいても、統計的に有意な差は見られませんでした。")
-
         if "ANOVA" in test_type_multi:
             st.info("_💡 **分散分析 (ANOVA)**: t検定を3群以上に拡張した手法です。各グループのデータが正規分布に近く、分散が等しい場合に、**平均値**の差を検定するのに適しています。_")
-            stat, p = stats.f_oneway(*samples)
+            stat, p = run_anova(samples, data_key, group_col, value_col)
 
             st.subheader("検定結果（分散分析）")
             res_col1, res_col2 = st.columns(2)
@@ -484,14 +711,14 @@ with tab3:
                 st.markdown("---")
                 st.subheader("多重比較（Tukey-HSD法）")
                 st.info("_どのグループ間に具体的な差があるかを確認します。_")
-                posthoc_p_values = sp.posthoc_tukey(df_filtered, val_col=value_col, group_col=group_col)
+                posthoc_p_values = run_posthoc_tukey(samples, groups, data_key, group_col, value_col)
                 display_posthoc_results(posthoc_p_values)
             else:
                 st.info("ℹ️ **全体の結果**: グループ間に、統計的に**有意な差があるとは言えません**。 (p ≥ 0.05)")
 
         else:
             st.info("_💡 **クラスカル・ウォリス検定**: U検定を3群以上に拡張したノンパラメトリックな手法です。データが正規分布に従わない場合や、順序尺度の場合に、グループの**分布（中央値）**に差があるかを検定します。_")
-            stat, p = stats.kruskal(*samples)
+            stat, p = run_kruskal(samples, data_key, group_col, value_col)
             
             st.subheader("検定結果（クラスカル・ウォリス検定）")
             res_col1, res_col2 = st.columns(2)
@@ -503,13 +730,14 @@ with tab3:
                 st.markdown("---")
                 st.subheader("多重比較（Dunn法）")
                 st.info("_どのグループ間に具体的な差があるかを確認します。_")
-                posthoc_p_values = sp.posthoc_dunn(df_filtered, val_col=value_col, group_col=group_col, p_adjust='holm')
+                posthoc_p_values = run_posthoc_dunn(samples, groups, data_key, group_col, value_col)
                 display_posthoc_results(posthoc_p_values)
             else:
                 st.info("ℹ️ **全体の結果**: グループ間に、統計的に**有意な差があるとは言えません**。 (p ≥ 0.05)")
 
-# --- タブ4: 前後比較 ---
-with tab4:
+@st.fragment
+def render_tab4(df, numeric_cols, data_key):
+    """⑤ 前後比較タブを表示する関数"""
     st.header("⑤ 前後比較：対応のある検定")
     st.write("同じ対象に対する介入の前後などで、数値に統計的に意味のある変化があったか検定します。")
     col1_pre, col2_post = st.columns(2)
@@ -522,9 +750,9 @@ with tab4:
         if col_pre == col_post:
             st.warning("事前と事後には異なる列を選択してください。")
         else:
-            temp_df = df[[col_pre, col_post]].dropna() 
-            before = temp_df[col_pre]
-            after = temp_df[col_post]
+            # 事前・事後を (行数, 2) の配列にまとめ、どちらかが欠損している行を除外
+            arr = paired_values(df, data_key, col_pre, col_post)
+            before, after = arr[:, 0], arr[:, 1]
             
             if len(before) == 0:
                 st.warning("比較できる有効なデータがありません。行に欠損値がないか確認してください。")
@@ -532,13 +760,15 @@ with tab4:
                 st.write(f"**比較対象**: `{col_pre}` vs `{col_post}` (n={len(before)})")
                 test_type_rel = st.radio("使用する検定", ["対応のあるt検定", "ウィルコクソン符号順位検定"], horizontal=True)
 
+                test_results = paired_tests(before, after, data_key, col_pre, col_post)
+
                 st.markdown("---")
                 if test_type_rel == "対応のあるt検定":
                     st.info("_💡 **対応のあるt検定**: 前後差のデータが正規分布に近い場合に適しています。_")
-                    stat, p = stats.ttest_rel(before, after)
+                    stat, p = test_results["t"]
                 else:
                     st.info("_💡 **ウィルコクソン符号順位検定**: 前後差のデータが正規分布に従わない場合に用います。_")
-                    stat, p = stats.wilcoxon(before, after)
+                    stat, p = test_results["wilcoxon"]
 
                 st.subheader("検定結果")
                 res_col1, res_col2 = st.columns(2)
@@ -551,11 +781,124 @@ with tab4:
                     st.info(f"ℹ️ **結論**: 事前（{col_pre}）と事後（{col_post}）で統計的に**有意な変化は見られませんでした**。 (p ≥ 0.05)")
 
                 st.subheader("📊 平均値の比較グラフ")
-                df_plot = pd.DataFrame({'平均値': [before.mean(), after.mean()]}, index=[f'事前({col_pre})', f'事後({col_post})'])
-                fig = px.bar(df_plot, y='平均値', color=df_plot.index, title='事前・事後の平均値比較', text_auto=True)
-                fig.update_traces(textposition='outside')
+                df_plot = pd.DataFrame({'平均値': arr.mean(axis=0)}, index=[f'事前({col_pre})', f'事後({col_post})']) # 事前・事後の平均値を一度に計算
+                fig = make_bar_prepost(df_plot)
                 st.plotly_chart(fig, use_container_width=True)
 
+
+# --- サイドバー ---
+with st.sidebar:
+    st.header("1. データ準備")
+    uploaded_file = st.file_uploader("CSVファイルをアップロードしてください", type="csv")
+    
+    if uploaded_file:
+        st.success(f"✅ ファイルがアップロードされました: `{uploaded_file.name}`")
+
+    st.subheader("📥 サンプルCSVのダウンロード")
+    st.download_button(
+        label="📄 サンプルCSVをダウンロード",
+        data=SAMPLE_CSV_BYTES,
+        file_name="sample_survey_multi_group.csv",
+        mime="text/csv"
+    )
+
+    st.header("2. このアプリについて")
+    with st.expander("各分析手法の簡単な説明", expanded=False):
+        st.markdown("""
+        #### 🔍 記述統計
+        データの平均、中央値、ばらつき（標準偏差）などを計算し、データ全体の基本的な特徴を把握します。
+        
+        #### 📊 段階評価分析
+        「満足度」など、1〜5段階で評価された項目について、回答の割合を円グラフで可視化します。「所属」などのカテゴリ別に割合を見ることもできます。
+
+        #### 🔄 クロス集計
+        「所属」と「性別」など、2つのカテゴリの関係性を表にまとめ、グループごとの傾向を視覚化します。
+        
+        #### ⚖️ 群間比較
+        「営業部」「開発部」「人事部」のように、複数のグループ間で特定の数値に統計的に意味のある差（有意差）があるかを検定します。
+        - **2グループの場合**: t検定やU検定を用います。
+        - **3グループ以上の場合**: **分散分析 (ANOVA)** やクラスカル・ウォリス検定を用います。
+        
+        *このアプリでは、グループ数を自動で判別して適切な手法を提案します。*
+        
+        #### ⏱ 前後比較
+        研修の前後など、同じ対象の状況が変化したかを統計的に検定します。
+        """)
+
+    # --- 使い方ガイドボタンの追加 ---
+    st.markdown("---")
+    st.subheader("💡 使い方ガイド")
+    col_guide_btn1, col_guide_btn2 = st.columns(2)
+    with col_guide_btn1:
+        if st.button("📚 アプリの使い方を見る", help="アプリの操作方法をステップバイステップで説明します。", key="open_guide_sidebar"):
+            st.session_state["show_guide"] = True
+    with col_guide_btn2:
+        # ガイドが開いている場合のみ「閉じる」ボタンを表示
+        if st.session_state.get("show_guide", False):
+            if st.button("❌ ガイドを閉じる", help="使い方ガイドを閉じます。", key="close_guide_sidebar"):
+                st.session_state["show_guide"] = False
+
+
+# --- メイン画面 ---
+st.title("📊 アンケートデータ統計分析アプリ")
+st.write("アップロードしたCSVデータの簡単な統計分析と可視化を行います。")
+
+# 使い方ガイドの表示
+if st.session_state.get("show_guide", False):
+    render_guide()
+    st.stop() # ガイド表示中はメインのアプリ本体は停止
+
+if not uploaded_file:
+    st.info("👆 サイドバーからCSVファイルをアップロードして分析を開始してください。")
+    st.stop()
+
+# --- ファイルがアップロードされた後の処理 ---
+# 同じアップロードの間は、読み込んだデータと列タイプをセッションに保持して再利用する
+# （ファイルが変わったときだけ読み込み直すので、操作のたびにファイル全体をハッシュしない）
+if st.session_state.get("df_file_id") != uploaded_file.file_id:
+    file_bytes = uploaded_file.getvalue()
+    try:
+        df, numeric_cols, cat_cols = load_csv(file_bytes, CATEGORY_MAX_RATIO) # 列タイプも一緒に取得
+    except Exception as e:
+        st.error(f"❌ ファイルの読み込み中にエラーが発生しました: {e}")
+        st.stop()
+    st.session_state["df"] = df
+    st.session_state["df_cols"] = (numeric_cols, cat_cols)
+    # キャッシュする関数にはデータの代わりにファイル内容のハッシュを渡す
+    # （Streamlitは5万行以上の表を一部の行だけでハッシュするため、表をそのまま渡すと別のファイルでも同じキーになりうる）
+    st.session_state["df_key"] = hashlib.sha256(file_bytes).hexdigest()
+    st.session_state["df_file_id"] = uploaded_file.file_id
+
+df = st.session_state["df"]
+numeric_cols, cat_cols = st.session_state["df_cols"]
+data_key = st.session_state["df_key"]
+
+with st.expander("アップロードしたデータのプレビュー", expanded=False):
+    st.dataframe(df)
+
+# --- 分析タブ ---
+tab1, tab5, tab2, tab3, tab4 = st.tabs(["① 記述統計", "② 段階評価分析", "③ クロス集計", "④ 群間比較", "⑤ 前後比較"])
+
+# --- タブ1: 記述統計 ---
+with tab1:
+    render_tab1(df, numeric_cols, data_key)
+
+# --- タブ5: 段階評価分析 ---
+with tab5:
+    render_tab5(df, numeric_cols, cat_cols, data_key)
+
+# --- タブ2: クロス集計 ---
+with tab2:
+    render_tab2(df, cat_cols, data_key)
+
+# --- タブ3: 群間比較 ---
+with tab3:
+    render_tab3(df, numeric_cols, cat_cols, data_key)
+
+# --- タブ4: 前後比較 ---
+with tab4:
+    render_tab4(df, numeric_cols, data_key)
+
 st.markdown("---")
 st.header("📖 統計用語の簡単な説明")
 with st.expander("クリックして各用語の説明を確認"):